@@ -4,27 +4,36 @@ import base64
 import warnings
 import html
 import json
-from io import StringIO
+from io import BytesIO
 from datetime import datetime
 
 import pandas as pd
 import streamlit as st
 import requests
 
+from schema import CSV_DTYPES as FINAL_DTYPES
+
 # ================== CONFIG ==================
 CSV_PATH    = "reviews_clickcannabis_ia.csv"   # base que o app lê
+PARQUET_PATH = "reviews_clickcannabis_ia.parquet"  # base canônica que o pipeline lê
 BACKUP_DIR  = "_backups"
+JOURNAL_PATH = "usados_journal.csv"            # log append-only dos toggles locais
 BRAND_GREEN = "#006f19"
 PAGE_BG     = "#f1f2f2"
 
 # ---- Persistência remota do "Já usei" ----
-STATE_FILE = "usados_state.csv"                              # arquivo salvo no repo
+STATE_FILE = "usados_state.parquet"                          # arquivo salvo no repo
+LEGACY_STATE_FILE = "usados_state.csv"                       # formato antigo (só leitura)
 GH_TOKEN   = st.secrets.get("GH_TOKEN")                      # obrigatório para salvar
 GH_REPO    = st.secrets.get("GH_REPO", "vnogueira-click/depoimentos_click")
 GH_BRANCH  = st.secrets.get("GH_BRANCH", "main")
 
 warnings.filterwarnings("ignore", message="Could not infer format")
 
+# Tipos fixos na leitura do CSV (esquema do classificador; float32 para poupar memória)
+CSV_DTYPES = {**FINAL_DTYPES, "rating": "float32", "confianca_ia": "float32"}
+TRUTHY = dict.fromkeys(["1","true","sim","yes","y","t"], True)   # valores aceitos em "usado"
+
 # ================== UTILS ===================
 def b64img(path: str) -> str:
     try:
@@ -34,16 +43,59 @@ def b64img(path: str) -> str:
         return ""
 
 def save_df(df: pd.DataFrame, path: str) -> None:
-    """Backup local (opcional) + salvar CSV principal (não o de estado)."""
+    """Backup local (opcional) + salvar CSV principal e o Parquet do pipeline (não o de estado)."""
+    # colunas derivadas do load_df (_cats_set, data_iso_dt, ...) não vão para o disco
+    df = df[[c for c in df.columns if not c.startswith("_") and c != "data_iso_dt"]]
     os.makedirs(BACKUP_DIR, exist_ok=True)
     ts = datetime.now().strftime("%Y%m%d-%H%M%S")
     bak = os.path.join(BACKUP_DIR, f"{os.path.basename(path)}.{ts}.bak.csv")
     df.to_csv(bak, index=False, encoding="utf-8-sig")
     df.to_csv(path, index=False, encoding="utf-8-sig")
+    # o run_all/classificador leem o Parquet (e regravam o CSV a partir dele)
+    df.to_parquet(PARQUET_PATH, engine="pyarrow", compression="snappy", index=False)
+
+def append_journal(rid: str, usado: bool, usado_em: str) -> None:
+    """Registra um toggle no journal (uma linha, sem reescrever o CSV)."""
+    new = not os.path.exists(JOURNAL_PATH)
+    with open(JOURNAL_PATH, "a", encoding="utf-8") as f:
+        if new:
+            f.write("review_id,usado,usado_em\n")
+        f.write(f"{rid},{int(usado)},{usado_em}\n")
+
+def file_mtime(path: str) -> float:
+    """mtime do arquivo (0.0 se não existir) — usado como chave dos caches."""
+    return os.path.getmtime(path) if os.path.exists(path) else 0.0
+
+@st.cache_data
+def load_journal(path: str, mtime: float) -> pd.DataFrame:
+    """Último valor de cada review_id registrado no journal (indexado por review_id)."""
+    if not mtime:
+        return pd.DataFrame(columns=["usado", "usado_em"])
+    j = pd.read_csv(path, dtype=str, keep_default_na=False)
+    return j.drop_duplicates(subset=["review_id"], keep="last").set_index("review_id")
+
+def apply_journal(df: pd.DataFrame, j: pd.DataFrame) -> pd.DataFrame:
+    """Aplica sobre o df os toggles do journal."""
+    if j.empty:
+        return df
+    rid = df["review_id"].astype(str)
+    hit = rid.isin(j.index)
+    df.loc[hit, "usado"] = rid[hit].map(j["usado"]).eq("1")
+    df.loc[hit, "usado_em"] = rid[hit].map(j["usado_em"])
+    return df
 
-@st.cache_data(ttl=30)
-def load_df(path: str) -> pd.DataFrame:
-    df = pd.read_csv(path)
+def unsynced_journal(j: pd.DataFrame, state_df: pd.DataFrame) -> pd.DataFrame:
+    """Entradas do journal cujo valor ainda difere do estado remoto (toggle não sincronizado)."""
+    if j.empty:
+        return j
+    remote = state_df.drop_duplicates(subset=["review_id"], keep="last").set_index("review_id")["usado"]
+    remote = remote.reindex(j.index).astype(str).str.strip().str.lower().map(TRUTHY).fillna(False)
+    return j[j["usado"].eq("1").ne(remote.astype(bool))]
+
+@st.cache_data
+def load_df(path: str, mtime: float) -> pd.DataFrame:
+    """Carrega o CSV e pré-calcula colunas derivadas; `mtime` só serve de chave do cache."""
+    df = pd.read_csv(path, dtype=CSV_DTYPES)
     needed = [
         "categorias_ia","confianca_ia","justificativa_ia","imagens_do_review",
         "review_link","autor_nome","texto","usado","usado_em","rating",
@@ -52,9 +104,40 @@ def load_df(path: str) -> pd.DataFrame:
     for col in needed:
         if col not in df.columns:
             df[col] = "" if col not in ("confianca_ia", "usado") else (0.0 if col=="confianca_ia" else False)
-    df["usado"] = df["usado"].astype(str).str.lower().isin(["1","true","sim","yes","y","t"])
+    if df["usado"].dtype != bool:  # CSV com True/False já chega como bool
+        df["usado"] = df["usado"].astype(str).str.lower().map(TRUTHY).fillna(False).astype(bool)
+    # Conjunto de categorias por linha (filtro por categoria vira lookup em hash)
+    df["_cats_set"] = df["categorias_ia"].fillna("").astype(str).str.split(",").map(
+        lambda xs: frozenset(c.strip() for c in xs if c.strip())
+    )
+    # Versões minúsculas para a busca (evita lower() a cada rerun)
+    df["_autor_lc"] = df["autor_nome"].fillna("").astype(str).str.lower()
+    df["_texto_lc"] = df["texto"].fillna("").astype(str).str.lower()
+    # Data já convertida uma vez (ordenação sem reparse a cada rerun)
+    df["data_iso_dt"] = pd.to_datetime(df["data_iso"], errors="coerce", utc=True)
+    # Autor (nome, link, foto) extraído uma vez; o render só lê as colunas
+    parsed = df["autor_nome"].fillna("").map(parse_author)
+    autor_cols = ["_autor_name", "_autor_link", "_autor_thumb"]
+    df[autor_cols] = pd.DataFrame(parsed.tolist(), index=df.index, columns=autor_cols)
+    # HTML já escapado para os cards (uma vez por carga, não por rerun)
+    esc = lambda col: df[col].fillna("").astype(str).map(html.escape)
+    df["_safe_autor"] = df["_autor_name"].astype(str).map(html.escape)
+    texto = df["texto"].fillna("").astype(str).str.strip().replace("", "_(sem texto)_")
+    df["_safe_texto"] = texto.map(html.escape).str.replace("\n", "<br>", regex=False)
+    df["_safe_cats"] = esc("categorias_ia").replace("", "—")
+    df["_safe_justificativa"] = esc("justificativa_ia")
+    df["_imgs_list"] = df["imagens_do_review"].map(split_imgs)
     return df
 
+@st.cache_data
+def unique_categories(path: str, mtime: float) -> list[str]:
+    """Lista ordenada de categorias distintas; recalcula só quando o CSV muda."""
+    df = load_df(path, mtime)
+    return sorted({
+        c.strip() for row in df["categorias_ia"].fillna("")
+        for c in row.split(",") if c.strip()
+    })
+
 def split_imgs(s: str):
     if not isinstance(s, str):
         return []
@@ -79,15 +162,22 @@ def gh_headers():
         "Accept": "application/vnd.github+json"
     }
 
+@st.cache_resource
+def gh_session() -> requests.Session:
+    """Sessão HTTP reutilizada entre reruns (pool de conexões/TLS com a API do GitHub)."""
+    s = requests.Session()
+    s.headers.update(gh_headers())
+    return s
+
 def gh_get_file(path):
-    """Lê arquivo no GitHub. Retorna (texto, sha) ou (None, None) se não existir."""
+    """Lê arquivo no GitHub. Retorna (bytes, sha) ou (None, None) se não existir."""
     if not GH_TOKEN:
         return None, None
     url = f"https://api.github.com/repos/{GH_REPO}/contents/{path}?ref={GH_BRANCH}"
-    r = requests.get(url, headers=gh_headers(), timeout=30)
+    r = gh_session().get(url, timeout=30)
     if r.status_code == 200:
         data = r.json()
-        content = base64.b64decode(data["content"]).decode("utf-8")
+        content = base64.b64decode(data["content"])
         sha = data["sha"]
         return content, sha
     if r.status_code == 404:
@@ -95,48 +185,93 @@ def gh_get_file(path):
     st.error(f"GitHub GET falhou: {r.status_code} - {r.text}")
     return None, None
 
-def gh_put_file(path, text, sha=None, message="feat(app): update usados_state"):
-    """Grava/atualiza arquivo no GitHub."""
+def gh_put_file(path, content: bytes, sha=None, message="feat(app): update usados_state"):
+    """Grava/atualiza arquivo no GitHub. Retorna (novo_sha, status); novo_sha=None se falhar."""
     if not GH_TOKEN:
-        return False
+        return None, None
     url = f"https://api.github.com/repos/{GH_REPO}/contents/{path}"
     body = {
         "message": message,
-        "content": base64.b64encode(text.encode("utf-8")).decode(),
+        "content": base64.b64encode(content).decode(),
         "branch": GH_BRANCH
     }
     if sha:
         body["sha"] = sha
-    r = requests.put(url, headers=gh_headers(), data=json.dumps(body), timeout=30)
+    r = gh_session().put(url, data=json.dumps(body), timeout=30)
     if r.status_code not in (200, 201):
-        st.error(f"GitHub PUT falhou: {r.status_code} - {r.text}")
-        return False
-    return True
+        if r.status_code not in (409, 422):  # sha desatualizado/ausente; quem chamou tenta de novo
+            st.error(f"GitHub PUT falhou: {r.status_code} - {r.text}")
+        return None, r.status_code
+    return r.json()["content"]["sha"], r.status_code
 
 @st.cache_data(ttl=15)
 def load_state_df() -> pd.DataFrame:
-    """Lê o CSV de estado (review_id, usado, usado_em) salvo no GitHub."""
-    txt, _ = gh_get_file(STATE_FILE)
-    if not txt:
+    """Lê o estado (review_id, usado, usado_em) salvo no GitHub em Parquet."""
+    raw, _ = gh_get_file(STATE_FILE)
+    if raw:
+        return pd.read_parquet(BytesIO(raw))
+    # migração: ainda não existe o Parquet, lê o CSV antigo
+    raw, _ = gh_get_file(LEGACY_STATE_FILE)
+    if not raw:
         return pd.DataFrame(columns=["review_id","usado","usado_em"])
-    return pd.read_csv(StringIO(txt))
+    return pd.read_csv(BytesIO(raw), encoding="utf-8-sig")
 
 def save_state_df(df_state: pd.DataFrame) -> bool:
-    """Salva o CSV de estado no GitHub e limpa caches para refletir no app."""
+    """Salva o estado (Parquet) no GitHub e limpa o cache do estado para refletir no app."""
     if not GH_TOKEN:
         st.warning("GH_TOKEN não configurado; estado não será persistido no GitHub.")
         return False
-    _, sha = gh_get_file(STATE_FILE)
-    csv_txt = df_state.to_csv(index=False, encoding="utf-8-sig")
-    ok = gh_put_file(STATE_FILE, csv_txt, sha=sha)
+    # sha do último PUT fica na sessão: só consulta o GitHub se ainda não há sha
+    # (1º save, GET com erro, arquivo novo) ou depois de um PUT recusado
+    sha = st.session_state.get("state_sha") or gh_get_file(STATE_FILE)[1]
+    buf = BytesIO()
+    df_state = df_state.fillna({"usado_em": ""}).astype({"review_id": str, "usado": bool, "usado_em": str})
+    df_state.to_parquet(buf, index=False)
+    new_sha, status = gh_put_file(STATE_FILE, buf.getvalue(), sha=sha)
+    if not new_sha and status is not None:
+        # 409 (sha velho) ou 422 (sha ausente para arquivo que já existe): relê e tenta 1x
+        _, sha = gh_get_file(STATE_FILE)
+        new_sha, status = gh_put_file(STATE_FILE, buf.getvalue(), sha=sha)
+        if status in (409, 422):
+            st.error(f"GitHub PUT falhou: sha desatualizado ({status}).")
+    if not new_sha:
+        st.session_state.pop("state_sha", None)
+        return False
+    st.session_state["state_sha"] = new_sha
+    load_state_df.clear()
+    return True
+
+def all_pending() -> dict:
+    """Toggles a sincronizar: os do journal que o remoto ainda não tem (refeitos a
+    cada rerun) + os desta sessão, que prevalecem."""
+    return {**st.session_state.get("journal_pending", {}), **st.session_state.get("pending", {})}
+
+def flush_pending() -> bool:
+    """Envia de uma vez ao GitHub todos os toggles pendentes (sessão + journal)."""
+    pending = all_pending()
+    if not pending:
+        return True
+    sdf = load_state_df()
+    if sdf.empty:
+        sdf = pd.DataFrame(columns=["review_id","usado","usado_em"])
+    sdf["review_id"] = sdf["review_id"].astype(str)
+    upd = pd.DataFrame(
+        [{"review_id": r, "usado": u, "usado_em": em} for r, (u, em) in pending.items()]
+    )
+    sdf = pd.concat([sdf[~sdf["review_id"].isin(upd["review_id"])], upd], ignore_index=True)
+    ok = save_state_df(sdf)
     if ok:
-        st.cache_data.clear()
+        st.session_state.get("pending", {}).clear()
+        st.session_state.get("journal_pending", {}).clear()
     return ok
 
 # ================== PAGE SETUP ===============
 st.set_page_config(page_title="Reviews ClickCannabis", layout="wide")
 
-st.markdown(f"""
+@st.cache_resource
+def page_css() -> str:
+    """CSS da página, interpolado uma vez por processo (o script roda a cada rerun)."""
+    return f"""
 <style>
     @import url('https://fonts.googleapis.com/css2?family=Inter:wght@400;500;600;700&display=swap');
     body, .stApp {{ font-family: 'Inter', sans-serif; background-color: {PAGE_BG}; }}
@@ -158,6 +293,7 @@ st.markdown(f"""
     .rating-stars {{ font-size: 14px; color: #f59e0b; }}
     .confidence-text {{ font-size: 13px; color: #6b7280; }}
     .date-text {{ font-size: 12px; color: #9ca3af; }}
+    .card-num {{ font-size: 12px; font-weight: 600; color: {BRAND_GREEN}; }}
     .review-text {{ font-size: 14px; line-height: 1.6; color: #374151; margin-bottom: 12px; }}
     .photo-links a {{ color: {BRAND_GREEN}; font-size: 13px; margin-right: 12px; text-decoration: none; font-weight: 500; }}
     .photo-links a:hover {{ text-decoration: underline; }}
@@ -170,7 +306,10 @@ st.markdown(f"""
     [data-testid="stSidebar"] {{ background-color: #ffffff; border-right: 1px solid #e5e7eb; }}
     #MainMenu, footer, header {{ visibility: hidden; }}
 </style>
-""", unsafe_allow_html=True)
+"""
+
+# Precisa ir em todo rerun: elemento não re-emitido some da página no Streamlit
+st.markdown(page_css(), unsafe_allow_html=True)
 
 # ================== SESSION STATE PARA PÁGINA ==================
 if 'page' not in st.session_state:
@@ -182,7 +321,10 @@ st.title("Reviews ClickCannabis")
 if not os.path.exists(CSV_PATH):
     st.error(f"Arquivo não encontrado: {CSV_PATH}")
     st.stop()
-df = load_df(CSV_PATH)
+df = load_df(CSV_PATH, file_mtime(CSV_PATH))
+# toggles locais ainda não compactados no CSV
+journal = load_journal(JOURNAL_PATH, file_mtime(JOURNAL_PATH))
+df = apply_journal(df, journal)
 
 # ---- Mescla estado remoto do GitHub (se existir) ----
 state_df = load_state_df()
@@ -198,33 +340,56 @@ else:
     if "usado" not in df.columns: df["usado"] = False
     if "usado_em" not in df.columns: df["usado_em"] = ""
 
+# Toggles do journal que o remoto ainda não tem (ex.: sessão anterior sem "Sincronizar"):
+# refeitos a cada rerun a partir do último valor do journal, à parte dos toggles
+# desta sessão; somem sozinhos quando o remoto passa a ter o mesmo valor
+unsynced = unsynced_journal(journal, state_df)
+st.session_state["journal_pending"] = {
+    jrid: (bool(jusado), jusado_em)
+    for jrid, jusado, jusado_em in zip(unsynced.index, unsynced["usado"].eq("1"), unsynced["usado_em"])
+}
+
+# Índice review_id -> posição, para o toggle não varrer a coluna inteira
+rid_to_idx = {r: i for i, r in enumerate(df["review_id"].astype(str))}
+
+# ---- Toggles ainda não sincronizados têm prioridade sobre o estado remoto ----
+for prid, (pusado, pusado_em) in all_pending().items():
+    if prid in rid_to_idx:
+        df.iat[rid_to_idx[prid], df.columns.get_loc("usado")] = pusado
+        df.iat[rid_to_idx[prid], df.columns.get_loc("usado_em")] = pusado_em
+
 with st.sidebar:
     st.image("logo_click_cannabis.png", width=220)
     st.divider()
     st.header("Filtros")
-    categorias_unicas = sorted(set(
-        c.strip() for row in df["categorias_ia"].fillna("")
-        for c in row.split(",") if c.strip()
-    ))
+    categorias_unicas = unique_categories(CSV_PATH, file_mtime(CSV_PATH))
     escolha = st.selectbox("Categoria", options=["TODOS"] + categorias_unicas, index=0)
     mostrar_nao_usados = st.checkbox("Mostrar só não usados", value=True)
     busca = st.text_input("Buscar (nome ou texto)", value="").strip()
-    conf_min = 0.0
     page_size = st.selectbox("Itens por página", options=[10, 20, 50, 100], index=1)
+    st.divider()
+    if st.button("Compactar base", use_container_width=True,
+                 help="Sincroniza os toggles pendentes, grava a base com eles e zera o journal."):
+        # zerar o journal com toggles fora do remoto os perderia (o remoto prevalece
+        # na mescla): sincroniza antes e só compacta se der certo
+        if GH_TOKEN and not flush_pending():
+            st.toast("Não compactado: falha ao sincronizar os toggles pendentes.", icon="⚠️")
+        else:
+            save_df(df, CSV_PATH)
+            if os.path.exists(JOURNAL_PATH):
+                os.remove(JOURNAL_PATH)
+            st.toast("Base compactada!", icon="✅")
 
 # ================== FILTERING ==================
-f = df.copy()
+f = df  # máscaras booleanas já devolvem novos frames
 if escolha != "TODOS":
-    f = f[f["categorias_ia"].fillna("").str.contains(rf"\b{escolha}\b", regex=True)]
+    f = f[f["_cats_set"].map(lambda cs: escolha in cs)]
 if mostrar_nao_usados:
     f = f[~f["usado"]]
 if busca:
     b = busca.lower()
-    f = f[ f["autor_nome"].fillna("").str.lower().str.contains(b) | f["texto"].fillna("").str.lower().str.contains(b) ]
-f = f[f["confianca_ia"].fillna(0.0).astype(float) >= conf_min]
-if "data_iso" in f.columns:
-    f["_ord"] = pd.to_datetime(f["data_iso"], errors="coerce", utc=True)
-    f = f.sort_values("_ord", ascending=False).drop(columns=["_ord"])
+    f = f[ f["_autor_lc"].str.contains(b, regex=False) | f["_texto_lc"].str.contains(b, regex=False) ]
+f = f.sort_values("data_iso_dt", ascending=False)
 
 st.subheader(f"Resultados: {len(f)} review(s)" + (f" — Categoria **{escolha}**" if escolha!="TODOS" else ""))
 
@@ -244,26 +409,26 @@ with col2:
     st.write(f"{st.session_state.page} de {total_pages}")
 
 start, end = (st.session_state.page - 1) * page_size, (st.session_state.page - 1) * page_size + page_size
-sub = f.iloc[start:end].copy()
+sub = f.iloc[start:end]  # só leitura no render; sem cópia
 
 # ================== RENDER CARDS ============
-for idx, row in sub.iterrows():
+# Cards vão num único st.markdown; só os toggles são widgets individuais
+cards_html = []
+toggles = []
+# to_dict("records") evita montar uma Series por linha como o iterrows()
+for n, (idx, row) in enumerate(zip(sub.index, sub.to_dict("records")), start + 1):
     rid = str(row.get("review_id", ""))
-    autor, autor_profile, _ = parse_author(row.get("autor_nome", ""))
     data = row.get("data_original", "") or "um mês atrás"
     rating = row.get("rating", "")
     rating_f = float(rating) if rating else None
     conf = float(row.get("confianca_ia", 0.0) or 0.0)
-    cats = row.get("categorias_ia", "") or "—"
-    texto = (row.get("texto", "") or "").strip() or "_(sem texto)_"
-    imgs = split_imgs(row.get("imagens_do_review", ""))
+    imgs = row["_imgs_list"]
     review_link = row.get("review_link", "")
-    justificativa = row.get("justificativa_ia", "")
 
-    safe_autor = html.escape(autor)
-    safe_texto = html.escape(texto).replace("\n", "<br>")
-    safe_cats = html.escape(cats)
-    safe_justificativa = html.escape(justificativa)
+    safe_autor = row["_safe_autor"]
+    safe_texto = row["_safe_texto"]
+    safe_cats = row["_safe_cats"]
+    safe_justificativa = row["_safe_justificativa"]
 
     if imgs:
         links_content = ''.join([f'<a href="{u}" target="_blank">Foto {i}</a>' for i, u in enumerate(imgs, 1)])
@@ -273,6 +438,7 @@ for idx, row in sub.iterrows():
 
     content_html = f"""
         <div class="review-header">
+            <span class="card-num">#{n}</span>
             <span class="author-name">{safe_autor} {f'<a href="{review_link}" target="_blank">↗</a>' if review_link else ''}</span>
             {'<span class="rating-stars">' + "⭐" * int(round(rating_f)) + f' {rating_f:.1f}</span>' if rating_f else ''}
             <span class="confidence-text">Confiança IA categorizar: {conf:.2f}</span>
@@ -281,47 +447,37 @@ for idx, row in sub.iterrows():
         <div class="review-text">{safe_texto}</div>
         {links_html}
         <div class="categories-text"><strong>Categorias IA:</strong> {safe_cats}</div>
-        {'<div class="categories-text"><strong>Justificativa da IA:</strong> ' + safe_justificativa + '</div>' if justificativa else ''}
+        {'<div class="categories-text"><strong>Justificativa da IA:</strong> ' + safe_justificativa + '</div>' if safe_justificativa else ''}
     """
 
-    col1, col2 = st.columns([15, 2])
-    with col1:
-        st.markdown(f'<div class="content-box">{content_html}</div>', unsafe_allow_html=True)
+    cards_html.append(f'<div class="content-box">{content_html}</div>')
+    toggles.append((n, rid, idx, bool(row.get("usado", False))))
+
+col1, col2 = st.columns([15, 2])
+with col1:
+    st.markdown("\n".join(cards_html), unsafe_allow_html=True)
 
-    with col2:
-        marcado = bool(row.get("usado", False))
-        novo = st.toggle("Já usei", value=marcado, key=f"usado_{rid}_{idx}")
+with col2:
+    for n, rid, idx, marcado in toggles:
+        novo = st.toggle(f"#{n} Já usei", value=marcado, key=f"usado_{rid}_{idx}")
         if novo != marcado:
+            ts_now = datetime.now().strftime("%Y-%m-%d %H:%M:%S") if novo else ""
             # 1) Atualiza base em memória (apenas esta linha exibida)
-            df.loc[df["review_id"].astype(str) == rid, "usado"] = novo
-            df.loc[df["review_id"].astype(str) == rid, "usado_em"] = (
-                datetime.now().strftime("%Y-%m-%d %H:%M:%S") if novo else ""
-            )
-            # 2) Persiste estado no GitHub
-            sdf = load_state_df()
-            if sdf.empty:
-                sdf = pd.DataFrame(columns=["review_id","usado","usado_em"])
-            sdf["review_id"] = sdf["review_id"].astype(str)
-            if rid in set(sdf["review_id"]):
-                sdf.loc[sdf["review_id"] == rid, ["usado","usado_em"]] = [
-                    novo,
-                    (datetime.now().strftime("%Y-%m-%d %H:%M:%S") if novo else "")
-                ]
-            else:
-                sdf = pd.concat([
-                    sdf,
-                    pd.DataFrame([{
-                        "review_id": rid,
-                        "usado": novo,
-                        "usado_em": (datetime.now().strftime("%Y-%m-%d %H:%M:%S") if novo else "")
-                    }])
-                ], ignore_index=True)
-
-            ok_remote = save_state_df(sdf)
-            # 3) (opcional) salva CSV principal localmente também
-            save_df(df, CSV_PATH)
-
-            if ok_remote:
-                st.toast("Salvo no GitHub!", icon="✅")
-            else:
-                st.toast("Falha ao salvar no GitHub", icon="⚠️")
+            i = rid_to_idx[rid]
+            df.iat[i, df.columns.get_loc("usado")] = novo
+            df.iat[i, df.columns.get_loc("usado_em")] = ts_now
+            # 2) Enfileira para o GitHub (enviado pelo botão "Sincronizar")
+            st.session_state.setdefault("pending", {})[rid] = (novo, ts_now)
+            # 3) registra localmente no journal (o CSV só é reescrito ao compactar)
+            append_journal(rid, novo, ts_now)
+            st.toast("Marcado! Clique em Sincronizar para salvar no GitHub.", icon="📝")
+
+# ================== SINCRONIZAÇÃO (GitHub) ==================
+with st.sidebar:
+    n_pending = len(all_pending())
+    if st.button(f"Sincronizar com GitHub ({n_pending})", use_container_width=True,
+                 disabled=(n_pending == 0)):
+        if flush_pending():
+            st.toast("Salvo no GitHub!", icon="✅")
+        else:
+            st.toast("Falha ao salvar no GitHub", icon="⚠️")
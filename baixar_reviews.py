@@ -1,7 +1,15 @@
 # baixar_reviews.py
-import os, sys, time, json, requests
+import os, sys, csv, time, queue, random, threading
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+import httpx
+import orjson
 import pandas as pd
-from dateutil import parser as dateparser
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from schema import REVIEW_COLUMNS, RAW_DTYPES as CSV_DTYPES
 
 # ===================== CONFIG ===================== #
 SERPAPI_KEY = os.getenv("SERPAPI_KEY") or ""
@@ -10,59 +18,154 @@ DATA_ID     = "0x9bdb4de1ad551d:0x2222b9defd4b9462"
 LANG        = "pt-BR"
 
 URL         = "https://serpapi.com/search.json"
-OUT_CSV     = "reviews_clickcannabis.csv"
+OUT_PARQUET = "reviews_clickcannabis.parquet"   # base canônica (colunar)
+OUT_CSV     = "reviews_clickcannabis.csv"       # exportação legível (o run_all recebe a base em memória)
 OUT_JSONL   = "reviews_clickcannabis.jsonl"
+STATE_JSON  = "reviews_clickcannabis.state.json"  # 1º review da página 1 na última busca completa
 
 PAGE_SLEEP  = 1.0            # pausa entre páginas
-RETRY_SLEEP = 3.0            # pausa entre tentativas
+RETRY_SLEEP = 3.0            # base do backoff exponencial entre tentativas
+RETRY_CAP   = 30.0           # teto de cada pausa de retry
+RETRY_JITTER = 0.5           # ±50% na pausa, para retries não saírem sincronizados
 MAX_RETRIES = 5              # tentativas por request
 MAX_PAGES   = 2000           # guarda-chuva
-OLD_STREAK_STOP = 8          # para quando encontrar N páginas seguidas só com ids já conhecidos
+KNOWN_STREAK_STOP = 20       # para após N ids já conhecidos seguidos (~2 páginas)
+JSONL_BATCH = 100            # reviews por escrita no JSONL (thread de gravação)
+
+# cliente único (keep-alive + HTTP/2): todas as páginas reaproveitam a mesma conexão.
+# O transporte refaz na hora falhas de conexão (DNS/TCP/TLS); status 429/5xx
+# ficam com o backoff do robust_get
+CLIENT      = httpx.Client(
+    timeout=60,
+    transport=httpx.HTTPTransport(
+        http2=True, retries=2,
+        limits=httpx.Limits(max_connections=4, max_keepalive_connections=4),
+    ),
+)
 
 # ===================== UTILS ====================== #
-def normalize_date(d):
-    if not d:
-        return ""
+def jsonl_writer(q: queue.Queue, path: str):
+    """Thread de gravação do JSONL: drena a fila em lotes até receber None."""
+    with open(path, "wb") as f:          # orjson já devolve bytes UTF-8
+        done = False
+        while not done:
+            batch = [q.get()]
+            while len(batch) < JSONL_BATCH and not q.empty():
+                batch.append(q.get_nowait())
+            if batch[-1] is None:
+                batch.pop()
+                done = True
+            f.write(b"".join(orjson.dumps(x) + b"\n" for x in batch))
+
+def iso_dates(s: pd.Series) -> pd.Series:
+    """data_original -> ISO 8601 numa passada vetorizada.
+
+    O que não vira data (ex.: "um mês atrás") fica como veio.
+    """
+    dt = pd.to_datetime(s, format="mixed", errors="coerce", utc=True)
+    return dt.dt.strftime("%Y-%m-%dT%H:%M:%S+00:00").fillna(s.fillna(""))
+
+def read_page1_top() -> str | None:
+    """Impressão digital (id|data do 1º review da página 1) da última busca completa."""
     try:
-        return dateparser.parse(d).isoformat()
-    except Exception:
-        return d
+        with open(STATE_JSON, "rb") as f:
+            return orjson.loads(f.read()).get("page1_top")
+    except (FileNotFoundError, orjson.JSONDecodeError):
+        return None
+
+def save_page1_top(fingerprint: str):
+    with open(STATE_JSON, "wb") as f:
+        f.write(orjson.dumps({"page1_top": fingerprint}))
 
-def read_known_ids(csv_path: str) -> set[str]:
-    """Carrega review_id já existentes (para parar cedo e evitar custo)."""
-    if not os.path.exists(csv_path):
+def read_known_ids(path: str) -> set[str]:
+    """Carrega review_id já existentes (para parar cedo e evitar custo).
+
+    Do Parquet lê só a coluna review_id; CSV é aceito para bases antigas.
+    """
+    if not os.path.exists(path):
         return set()
     try:
-        df = pd.read_csv(csv_path, usecols=["review_id"])
-        return set(df["review_id"].astype(str).dropna().str.strip().tolist())
+        if path.endswith(".parquet"):
+            col = pq.read_table(path, columns=["review_id"]).column("review_id")
+            return {str(rid).strip() for rid in col.to_pylist() if rid}
+        # csv puro: só precisamos de uma coluna, sem custo de DataFrame/inferência
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            return {rid.strip() for row in csv.DictReader(f) if (rid := row.get("review_id"))}
     except Exception:
         return set()
 
+def load_store() -> pd.DataFrame:
+    """Base completa: Parquet se existir, senão o CSV antigo (migração)."""
+    if os.path.exists(OUT_PARQUET):
+        return pd.read_parquet(OUT_PARQUET)
+    if os.path.exists(OUT_CSV):
+        return pd.read_csv(OUT_CSV, dtype=CSV_DTYPES)
+    return pd.DataFrame()
+
+def save_store(df: pd.DataFrame):
+    """Grava a base canônica em Parquet (zstd)."""
+    df = df.copy()
+    for c in df.columns[df.dtypes == object]:
+        # ex.: "user" da SerpAPI vem como dict; guarda como o CSV sempre guardou (repr)
+        df[c] = df[c].map(lambda v: str(v) if isinstance(v, (dict, list)) else v)
+    df.to_parquet(OUT_PARQUET, compression="zstd", index=False)
+
+class RecoverableError(Exception):
+    """Falha transitória (429, 5xx, timeout/conexão): vale tentar de novo."""
+
+class UnrecoverableError(Exception):
+    """Falha definitiva (4xx que não seja 429): não adianta repetir."""
+
+def backoff_delay(attempt: int) -> float:
+    """Backoff exponencial com teto e jitter."""
+    delay = min(RETRY_CAP, RETRY_SLEEP * 2 ** (attempt - 1))
+    return delay * (1 + random.uniform(-RETRY_JITTER, RETRY_JITTER))
+
+def retry_after(r: httpx.Response) -> float | None:
+    """Segundos pedidos pelo header Retry-After (número ou data HTTP), se houver."""
+    ra = r.headers.get("Retry-After")
+    if not ra:
+        return None
+    try:
+        return max(0.0, float(ra))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(ra) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
 def robust_get(params: dict) -> dict:
-    """GET com retries/backoff simples."""
+    """GET com retries só para erros transitórios (backoff exponencial + Retry-After)."""
     for attempt in range(1, MAX_RETRIES + 1):
         try:
-            r = requests.get(URL, params=params, timeout=60)
-            if r.status_code == 429:
-                # Too Many Requests — aguarda mais e tenta de novo
-                time.sleep(RETRY_SLEEP * attempt)
-                continue
-            r.raise_for_status()
-            return r.json()
-        except Exception as e:
-            if attempt == MAX_RETRIES:
-                raise
-            time.sleep(RETRY_SLEEP * attempt)
+            r = CLIENT.get(URL, params=params)
+        except httpx.TransportError as e:
+            err, wait = RecoverableError(f"{type(e).__name__}: {e}"), backoff_delay(attempt)
+        else:
+            if r.status_code == 429 or r.status_code >= 500:
+                err = RecoverableError(f"HTTP {r.status_code}")
+                wait = retry_after(r) or backoff_delay(attempt)
+            elif r.status_code >= 400:
+                raise UnrecoverableError(f"HTTP {r.status_code}: {r.text[:300]}")
+            else:
+                return orjson.loads(r.content)
+        if attempt == MAX_RETRIES:
+            raise err
+        time.sleep(wait)
     return {}
 
 # ===================== CORE ======================= #
-def fetch_all_reviews() -> list[dict]:
+def fetch_all_reviews() -> dict[str, list]:
+    """Busca reviews novos; devolve colunas (nome -> lista), prontas para o DataFrame."""
     if not SERPAPI_KEY:
         print("ERRO: defina SERPAPI_KEY no ambiente.", file=sys.stderr)
         sys.exit(1)
 
-    known_ids = read_known_ids(OUT_CSV)
-    print(f"🔎 IDs conhecidos no CSV atual: {len(known_ids)}")
+    # set exato de propósito: um filtro probabilístico (Bloom) teria falsos
+    # positivos, e um review novo tomado por "conhecido" seria perdido em silêncio
+    known_ids = read_known_ids(OUT_PARQUET if os.path.exists(OUT_PARQUET) else OUT_CSV)
+    print(f"🔎 IDs conhecidos na base atual: {len(known_ids)}")
 
     params_base = {
         "engine": "google_maps_reviews",
@@ -73,14 +176,19 @@ def fetch_all_reviews() -> list[dict]:
         # "no_cache": "true",
     }
 
-    new_rows: list[dict] = []
+    # colunas (structure-of-arrays): um append por campo, sem dict por review
+    new_cols: dict[str, list] = {c: [] for c in REVIEW_COLUMNS}
     seen_ids: set[str] = set()     # segurança intra-execução
+    page1_top = None               # impressão digital da página 1 desta execução
     next_token = None
     page = 0
-    old_streak = 0                 # páginas sem nada novo
+    known_streak = 0               # ids conhecidos seguidos, sem nenhum novo no meio
 
-    # abre JSONL para depuração/backup bruto
-    jf = open(OUT_JSONL, "w", encoding="utf-8")
+    # JSONL para depuração/backup bruto, gravado numa thread à parte
+    # (o disco não entra no caminho do loop de páginas)
+    jq: queue.Queue = queue.Queue()
+    jt = threading.Thread(target=jsonl_writer, args=(jq, OUT_JSONL), daemon=True)
+    jt.start()
 
     try:
         while True:
@@ -93,6 +201,7 @@ def fetch_all_reviews() -> list[dict]:
             if next_token:
                 params["next_page_token"] = next_token
 
+            t_req = time.monotonic()
             data = robust_get(params)
             reviews = data.get("reviews") or []
             next_token = (data.get("serpapi_pagination") or {}).get("next_page_token")
@@ -105,8 +214,10 @@ def fetch_all_reviews() -> list[dict]:
                     continue
                 seen_ids.add(rid)
 
-                # se já conhecemos, não é “novo”
+                # se já conhecemos, não é “novo”. Um id conhecido sozinho não
+                # encerra: review antigo editado sobe para o topo do "newest"
                 if rid in known_ids:
+                    known_streak += 1
                     continue
 
                 # >>> IGNORAR reviews sem comentário <<<
@@ -115,83 +226,123 @@ def fetch_all_reviews() -> list[dict]:
                     # pular quem só tem estrelas/foto
                     continue
 
-                # imagens (se houver)
-                image_urls = []
-                for img in (r.get("images") or []):
-                    if isinstance(img, dict):
-                        image_urls.append(img.get("original") or img.get("src"))
-                    elif isinstance(img, str):
-                        image_urls.append(img)
-
-                row = {
-                    "autor_nome": r.get("user") or r.get("user_name"),
-                    "autor_perfil_link": r.get("user_link"),
-                    "autor_foto": r.get("user_photo"),
-                    "rating": r.get("rating"),
-                    "data_original": r.get("date"),
-                    "data_iso": normalize_date(r.get("date")),
-                    "texto": texto,
-                    "review_link": r.get("link") or "",
-                    "review_id": rid,
-                    "helpful_votes": r.get("thumbs_up_count") or r.get("likes_count") or 0,
-                    "imagens_do_review": "|".join([u for u in image_urls if u]),
-                }
-
-                new_rows.append(row)
-                jf.write(json.dumps(r, ensure_ascii=False) + "\n")
+                # imagens (se houver): dict {original|src} ou URL direta
+                image_urls = [
+                    (img.get("original") or img.get("src")) if isinstance(img, dict) else img
+                    for img in (r.get("images") or ())
+                    if isinstance(img, (dict, str))
+                ]
+
+                new_cols["autor_nome"].append(r.get("user") or r.get("user_name"))
+                new_cols["autor_perfil_link"].append(r.get("user_link"))
+                new_cols["autor_foto"].append(r.get("user_photo"))
+                new_cols["rating"].append(r.get("rating"))
+                new_cols["data_original"].append(r.get("date"))
+                new_cols["data_iso"].append("")          # preenchido em lote no main()
+                new_cols["texto"].append(texto)
+                new_cols["review_link"].append(r.get("link") or "")
+                new_cols["review_id"].append(rid)
+                new_cols["helpful_votes"].append(r.get("thumbs_up_count") or r.get("likes_count") or 0)
+                new_cols["imagens_do_review"].append("|".join(u for u in image_urls if u))
+
+                jq.put(r)
                 added_this_page += 1
+                known_streak = 0
 
             # logs
-            print(f"🟩 Página {page:>3}: +{added_this_page} novos (acumulado: {len(new_rows)})")
-
-            # controle de parada:
-            if added_this_page == 0:
-                old_streak += 1
-            else:
-                old_streak = 0
-
-            # se já passamos OLD_STREAK_STOP páginas sem nada novo: parar cedo
-            if old_streak >= OLD_STREAK_STOP:
-                print(f"✅ {OLD_STREAK_STOP} páginas seguidas sem novos. Encerrando cedo para poupar créditos.")
+            print(f"🟩 Página {page:>3}: +{added_this_page} novos (acumulado: {len(new_cols['review_id'])})")
+
+            # página 1 igual à da última busca completa (mesmo 1º review) e nada novo
+            # nela: não há o que paginar, a execução custa 1 chamada só
+            if page == 1 and reviews:
+                top = reviews[0]
+                page1_top = f"{top.get('review_id') or top.get('id') or top.get('reviewId')}|{top.get('date')}"
+                if added_this_page == 0 and page1_top == read_page1_top():
+                    print("✅ Página 1 inalterada desde a última execução. Encerrando.")
+                    break
+
+            # controle de parada: só depois de uma sequência de ids conhecidos
+            # (a página inteira já foi conferida acima, sem custo extra de créditos)
+            if known_streak >= KNOWN_STREAK_STOP:
+                print(f"✅ {known_streak} reviews já conhecidos seguidos. Encerrando cedo para poupar créditos.")
                 break
 
             if not next_token:
                 print("🔚 Sem next_page_token. Fim.")
                 break
 
-            time.sleep(PAGE_SLEEP)
+            # PAGE_SLEEP é o intervalo mínimo entre requests, não uma pausa extra:
+            # o tempo da própria request/processamento já conta
+            time.sleep(max(0.0, PAGE_SLEEP - (time.monotonic() - t_req)))
 
-    finally:
-        jf.close()
+        # só grava depois de uma busca que terminou: se ela caiu no meio, a próxima
+        # não pode pular páginas que não foram lidas
+        if page1_top:
+            save_page1_top(page1_top)
 
-    return new_rows
-
-def main():
-    novos = fetch_all_reviews()
+    finally:
+        jq.put(None)
+        jt.join()
 
-    if os.path.exists(OUT_CSV):
-        df_old = pd.read_csv(OUT_CSV)
-    else:
-        df_old = pd.DataFrame()
+    return new_cols
 
-    df_new = pd.DataFrame(novos)
-    df_all = pd.concat([df_new, df_old], ignore_index=True)
+def compact():
+    """Reescreve a base inteira deduplicada e ordenada (rodar de vez em quando)."""
+    df_all = load_store()
+    if df_all.empty:
+        print("Nada a compactar: base vazia.")
+        return
 
     # dedupe por (review_id, texto) para segurança
     keys = [c for c in ["review_id", "texto"] if c in df_all.columns]
     if keys:
         df_all = df_all.drop_duplicates(subset=keys, keep="first")
 
-    # ordenar por data se possível
+    # ordenar por data se possível (sort do Arrow, multi-thread; sem coluna temporária)
     if "data_iso" in df_all.columns:
-        df_all["data_iso_sort"] = pd.to_datetime(df_all["data_iso"], errors="coerce", utc=True)
-        df_all = df_all.sort_values("data_iso_sort", ascending=False).drop(columns=["data_iso_sort"])
+        ts = pa.array(pd.to_datetime(df_all["data_iso"], format="ISO8601", errors="coerce", utc=True))
+        idx = pc.array_sort_indices(ts, order="descending", null_placement="at_end")
+        df_all = pa.Table.from_pandas(df_all, preserve_index=False).take(idx).to_pandas()
 
+    save_store(df_all)
     df_all.to_csv(OUT_CSV, index=False, encoding="utf-8-sig")
-
-    print(f"\n📥 Novos salvos nesta execução: {len(novos)}")
-    print(f"🗂  Total no CSV: {len(df_all)}")
-    print(f"💾 Arquivos gerados: {OUT_CSV}  |  {OUT_JSONL}")
+    print(f"🗜  Base compactada: {len(df_all)} linhas em {OUT_PARQUET} | {OUT_CSV}")
+
+def main() -> pd.DataFrame:
+    """Baixa os reviews novos e devolve a base bruta completa (já em memória,
+    para o run_all não precisar reler o arquivo)."""
+    df_new = pd.DataFrame(fetch_all_reviews(), copy=False)
+    # ids conhecidos já foram filtrados no fetch (set de known_ids); o dedupe
+    # fica restrito ao lote novo, sem hash sobre o histórico inteiro
+    if not df_new.empty:
+        df_new = df_new.drop_duplicates(subset=["review_id"], keep="first")
+        df_new["data_iso"] = iso_dates(df_new["data_original"])
+
+    # base canônica em Parquet (na 1ª vez, migra o CSV existente)
+    if not df_new.empty or not os.path.exists(OUT_PARQUET):
+        df_all = pd.concat([df_new, load_store()], ignore_index=True)
+        save_store(df_all)
+    else:
+        df_all = load_store()
+
+    # CSV de exportação em append-only: fetch_all_reviews já descarta ids
+    # conhecidos, então não há duplicatas contra o histórico (dedupe/ordenação
+    # ficam no compact)
+    if not df_new.empty:
+        if os.path.exists(OUT_CSV):
+            header = pd.read_csv(OUT_CSV, nrows=0).columns
+            df_new.reindex(columns=header).to_csv(
+                OUT_CSV, mode="a", header=False, index=False, encoding="utf-8"
+            )
+        else:
+            df_new.to_csv(OUT_CSV, index=False, encoding="utf-8-sig")
+
+    print(f"\n📥 Novos salvos nesta execução: {len(df_new)}")
+    print(f"💾 Arquivos gerados: {OUT_PARQUET}  |  {OUT_CSV}  |  {OUT_JSONL}")
+    return df_all
 
 if __name__ == "__main__":
-    main()
+    if "--compact" in sys.argv[1:]:
+        compact()
+    else:
+        main()
@@ -2,19 +2,39 @@
 # -*- coding: utf-8 -*-
 
 import os
+import re
+import sys
 import json
 import time
+import signal
+import asyncio
+import hashlib
+import sqlite3
 from datetime import datetime
 
 import pandas as pd
 from tqdm import tqdm
-from tenacity import retry, stop_after_attempt, wait_exponential
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_exponential
 
-from openai import OpenAI
+from openai import (
+    AsyncOpenAI, OpenAI,
+    APIConnectionError, APITimeoutError, InternalServerError, RateLimitError,
+)
 
-CSV_PATH = "reviews_clickcannabis_ia.csv"   # base “final” que o app lê
+from schema import CSV_DTYPES
+
+FINAL_PARQUET = "reviews_clickcannabis_ia.parquet"  # base “final” canônica
+CSV_PATH = "reviews_clickcannabis_ia.csv"   # exportação que o app lê
 BACKUP_DIR = "_backups"
+CACHE_PATH = os.path.join("_cache", "classify_cache.sqlite")  # sha1(prompt + texto) -> resultado
+CHECKPOINT = "reviews_clickcannabis_ia.checkpoint.jsonl"  # resultados já obtidos (append-only)
+BATCH_STATE = "reviews_clickcannabis_ia.batch.json"       # id do batch em andamento (--batch)
 MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")  # pode trocar por outro
+CONCURRENCY = int(os.getenv("OPENAI_CONCURRENCY", "20"))  # requests simultâneos à API
+# folga mínima nos headers x-ratelimit-remaining-*: abaixo disso, pausa até o reset
+RATE_MIN_REQUESTS = CONCURRENCY
+RATE_MIN_TOKENS = CONCURRENCY * 1_000        # ~tokens por chamada (prompt + resposta)
+BATCH_POLL = 60                              # segundos entre consultas ao status do batch (--batch)
 
 CATEGORIAS = [
     "Atendimento", "É Golpe?", "Preço", "Click", "Sono", "Bem estar geral",
@@ -35,13 +55,52 @@ Regras:
 - Não invente fatos; use apenas o que está no texto do review.
 """
 
-def backup_csv(path: str):
-    """Salva cópia de segurança do CSV antes de atualizar."""
+# Structured outputs (strict): a API garante chaves, tipos e categorias válidas,
+# sem resposta malformada para reparsear/retentar
+RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "classify",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "categorias": {"type": "array", "items": {"type": "string", "enum": CATEGORIAS}},
+                "justificativa": {"type": "string"},
+                "confianca": {"type": "number"},
+            },
+            "required": ["categorias", "justificativa", "confianca"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+def read_final() -> pd.DataFrame | None:
+    """Base final: Parquet se existir, senão o CSV (migração). None se nenhum existir."""
+    if os.path.exists(FINAL_PARQUET):
+        return pd.read_parquet(FINAL_PARQUET, engine="pyarrow")
+    if os.path.exists(CSV_PATH):
+        return pd.read_csv(CSV_PATH, dtype=CSV_DTYPES)
+    return None
+
+def write_final(df: pd.DataFrame):
+    """Grava a base final em Parquet (snappy) e exporta o CSV lido pelo app."""
+    out = df.copy()
+    if "confianca_ia" in out.columns:
+        out["confianca_ia"] = pd.to_numeric(out["confianca_ia"], errors="coerce")
+    for c in out.columns[out.dtypes == object]:
+        # colunas com tipos misturados (ex.: str e bool) não viram coluna Arrow
+        if pd.api.types.infer_dtype(out[c], skipna=True).startswith("mixed"):
+            out[c] = out[c].map(lambda v: v if pd.isna(v) else str(v))
+    out.to_parquet(FINAL_PARQUET, engine="pyarrow", compression="snappy", index=False)
+    df.to_csv(CSV_PATH, index=False, encoding="utf-8-sig")
+
+def backup_csv(df: pd.DataFrame, path: str = CSV_PATH):
+    """Salva cópia de segurança (CSV) da base antes de atualizar."""
     os.makedirs(BACKUP_DIR, exist_ok=True)
     ts = datetime.now().strftime("%Y%m%d-%H%M%S")
     bak = os.path.join(BACKUP_DIR, f"{os.path.basename(path)}.{ts}.bak.csv")
     try:
-        df = pd.read_csv(path)
         df.to_csv(bak, index=False, encoding="utf-8-sig")
     except Exception:
         pass
@@ -50,102 +109,400 @@ def need_mask(df: pd.DataFrame):
     """Linhas que ainda precisam de IA (categorias_ia vazia/NaN)."""
     if "categorias_ia" not in df.columns:
         return pd.Series([True]*len(df), index=df.index)
-    s = df["categorias_ia"].astype(str).str.strip()
-    return (s.eq("")) | (s.eq("nan")) | (s.eq("None"))
+    s = df["categorias_ia"].fillna("").astype(str).str.strip()
+    return s.isin(["", "nan", "None"])
 
-@retry(stop=stop_after_attempt(4), wait=wait_exponential(multiplier=1, min=1, max=15))
-def classify_text(client: OpenAI, texto: str) -> dict:
-    """Chama a API para classificar um único review."""
-    user_prompt = f"Texto do review:\n\"\"\"\n{texto}\n\"\"\"\n\nResponda SOMENTE o JSON pedido."
-    resp = client.chat.completions.create(
-        model=MODEL,
-        temperature=0.1,
-        messages=[
+def request_body(texto: str) -> dict:
+    """Parâmetros do chat.completions para um review (tempo real e --batch)."""
+    # prefixo fixo (system + início do user) e o texto do review por último:
+    # mantém o trecho cacheável da API idêntico entre chamadas
+    user_prompt = f"Responda SOMENTE o JSON pedido.\nTexto do review:\n\"\"\"\n{texto}\n\"\"\""
+    return {
+        "model": MODEL,
+        "temperature": 0.1,
+        "messages": [
             {"role": "system", "content": SYSTEM_PROMPT},
             {"role": "user", "content": user_prompt},
         ],
-        response_format={ "type": "json_object" },  # força JSON
-    )
-    raw = resp.choices[0].message.content
-    return json.loads(raw)
+        "response_format": RESPONSE_FORMAT,
+    }
 
-def main():
-    api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key:
-        raise SystemExit("Defina OPENAI_API_KEY no ambiente.")
+# versão do pedido (modelo, prompts, schema, temperatura): entra na chave do cache,
+# então trocar OPENAI_MODEL, CATEGORIAS ou o prompt não reaproveita rótulos antigos
+PROMPT_HASH = hashlib.sha1(
+    json.dumps(request_body(""), sort_keys=True, ensure_ascii=False).encode("utf-8")
+).hexdigest()
 
-    # Carregar CSV
-    if not os.path.exists(CSV_PATH):
-        raise SystemExit(f"Arquivo não encontrado: {CSV_PATH}")
+class ClassifyCache:
+    """Cache persistente (SQLite) de classificações por sha1 do pedido + texto do review."""
 
-    df = pd.read_csv(CSV_PATH)
+    def __init__(self, path: str = CACHE_PATH):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS kv(h TEXT PRIMARY KEY, cats TEXT, just TEXT, conf REAL)"
+        )
 
-    # Garantir colunas destino
-    for col in ["categorias_ia", "justificativa_ia", "confianca_ia"]:
-        if col not in df.columns:
-            df[col] = ""
+    @staticmethod
+    def key(texto: str) -> str:
+        return hashlib.sha1(f"{PROMPT_HASH}\n{texto}".encode("utf-8")).hexdigest()
 
-    mask = need_mask(df)
-    idxs = df.index[mask].tolist()
+    def get(self, h: str) -> tuple[str, str, float] | None:
+        return self.conn.execute("SELECT cats, just, conf FROM kv WHERE h = ?", (h,)).fetchone()
 
-    if not idxs:
-        print("✅ Nada a classificar. Todas as linhas já possuem categorias_ia.")
+    def put(self, h: str, cats: str, just: str, conf: float):
+        self.conn.execute("INSERT OR REPLACE INTO kv VALUES (?, ?, ?, ?)", (h, cats, just, conf))
+
+    def commit(self):
+        self.conn.commit()
+
+    def close(self):
+        self.commit()
+        self.conn.close()
+
+def assign_results(df: pd.DataFrame, results: dict):
+    """Grava os resultados no df de uma vez (uma atribuição por coluna, não por célula)."""
+    if not results:
         return
+    idx = list(results)
+    cats, just, conf = zip(*results.values())
+    for col in ("categorias_ia", "justificativa_ia"):
+        df[col] = df[col].astype(object)
+    df.loc[idx, "categorias_ia"] = list(cats)
+    df.loc[idx, "justificativa_ia"] = list(just)
+    df.loc[idx, "confianca_ia"] = pd.to_numeric(pd.Series(conf, index=idx), errors="coerce")
 
-    backup_csv(CSV_PATH)
-    client = OpenAI(api_key=api_key)
+def write_checkpoint(f, i, review_id: str, cats: str, just: str, conf: float):
+    """Acrescenta um resultado ao checkpoint JSONL (uma linha; nada de reescrever o CSV)."""
+    rec = {"idx": int(i), "review_id": review_id, "cats": cats, "just": just, "conf": conf}
+    f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+    f.flush()
 
-    print(f"Classificando apenas as linhas novas: {len(idxs)} item(ns). Modelo: {MODEL}")
+def apply_checkpoint(df: pd.DataFrame) -> int:
+    """Retoma uma execução interrompida: aplica no df os resultados do checkpoint."""
+    if not os.path.exists(CHECKPOINT):
+        return 0
+    done = {}
+    with open(CHECKPOINT, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                rec = json.loads(line)
+                done[rec["review_id"]] = rec
+    if not done:
+        return 0
+    recs = pd.DataFrame(done.values()).set_index("review_id")
+    rid = df["review_id"].astype(str)
+    hit = rid.isin(recs.index) & need_mask(df)
+    df.loc[hit, "categorias_ia"] = rid[hit].map(recs["cats"])
+    df.loc[hit, "justificativa_ia"] = rid[hit].map(recs["just"])
+    df.loc[hit, "confianca_ia"] = rid[hit].map(recs["conf"])
+    return int(hit.sum())
+
+def reset_seconds(value: str | None) -> float:
+    """Duração dos headers x-ratelimit-reset-* ('20ms', '1s', '6m0s') em segundos."""
+    units = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    return sum(float(n) * units[u] for n, u in re.findall(r"([\d.]+)(ms|h|m|s)", value or ""))
+
+class RateGate:
+    """Limite adaptativo: só pausa as chamadas quando os headers de rate limit
+    da resposta indicam pouca folga (em vez de sleep fixo entre chamadas)."""
+
+    def __init__(self):
+        self.resume_at = 0.0
+
+    async def wait(self):
+        delay = self.resume_at - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def update(self, headers):
+        for kind, minimo in (("requests", RATE_MIN_REQUESTS), ("tokens", RATE_MIN_TOKENS)):
+            try:
+                remaining = int(headers.get(f"x-ratelimit-remaining-{kind}", ""))
+            except ValueError:
+                continue
+            if remaining <= minimo:
+                reset = reset_seconds(headers.get(f"x-ratelimit-reset-{kind}"))
+                self.resume_at = max(self.resume_at, time.monotonic() + reset)
+
+# só erros transitórios são retentados; os demais (ex.: 400, JSON inválido) falham na hora
+TRANSIENT_ERRORS = (RateLimitError, APITimeoutError, APIConnectionError, InternalServerError)
+
+@retry(retry=retry_if_exception_type(TRANSIENT_ERRORS), reraise=True,
+       stop=stop_after_attempt(4), wait=wait_exponential(multiplier=1, min=1, max=15))
+async def classify_text(client: AsyncOpenAI, gate: RateGate, texto: str) -> dict:
+    """Chama a API para classificar um único review."""
+    await gate.wait()
+    raw = await client.chat.completions.with_raw_response.create(**request_body(texto))
+    gate.update(raw.headers)
+    resp = raw.parse()  # LegacyAPIResponse: parse() é síncrono mesmo no AsyncOpenAI
+    return json.loads(resp.choices[0].message.content)
+
+def normalize_output(out: dict) -> tuple[str, str, float]:
+    """(categorias, justificativa, confianca) a partir do JSON da IA."""
+    cats = out.get("categorias", [])
+    just = out.get("justificativa", "")
+    conf = out.get("confianca", 0)
+
+    # Normalizações leves
+    if isinstance(cats, list):
+        cats = ", ".join([c.strip() for c in cats if c and isinstance(c, str)])
+    else:
+        cats = str(cats)
+
+    try:
+        conf = float(conf)
+    except Exception:
+        conf = 0.0
+    return cats, just, conf
+
+async def bound_classify(sem: asyncio.Semaphore, client: AsyncOpenAI, gate: RateGate, i, texto: str):
+    """Classifica um review respeitando o limite de concorrência. Retorna (i, resultado, ok)."""
+    async with sem:
+        try:
+            return i, normalize_output(await classify_text(client, gate, texto)), True
+        except Exception as e:
+            # Em caso de erro, mantém vazio e segue
+            return i, ("", f"Erro: {e}", 0.0), False
+
+async def classify_rows(df: pd.DataFrame, idxs: list, api_key: str, cache: ClassifyCache) -> int:
+    """Dispara as chamadas em paralelo (até CONCURRENCY) e grava no df conforme chegam.
+
+    Textos já vistos (cache ou repetidos nesta rodada) não geram nova chamada.
+    """
+    client = AsyncOpenAI(api_key=api_key)
+    sem = asyncio.Semaphore(CONCURRENCY)
+    gate = RateGate()
 
-    # Loop item-a-item (mais robusto p/ quedas de rede / rate limit)
     atualizados = 0
-    for i in tqdm(idxs, desc="Classificando"):
-        texto = str(df.at[i, "texto"] or "").strip()
+    results = {}                     # linha -> (categorias, justificativa, confianca)
+    grupos: dict[str, list] = {}     # sha1(texto) -> linhas com esse texto
+    rids = dict(zip(idxs, df.loc[idxs, "review_id"].astype(str).tolist()))  # sem df.at por resultado
+    tasks = []
+    textos = df.loc[idxs, "texto"].fillna("").astype(str).str.strip().tolist()
+    for i, texto in zip(idxs, textos):
         if not texto:
-            df.at[i, "categorias_ia"] = ""
-            df.at[i, "justificativa_ia"] = "Sem texto"
-            df.at[i, "confianca_ia"] = 0.0
+            results[i] = ("", "Sem texto", 0.0)
             atualizados += 1
             continue
+        h = ClassifyCache.key(texto)
+        if (hit := cache.get(h)) is not None:
+            results[i] = tuple(hit)
+            atualizados += 1
+            continue
+        if h not in grupos:
+            grupos[h] = []
+            tasks.append(asyncio.create_task(bound_classify(sem, client, gate, h, texto)))
+        grupos[h].append(i)
 
-        try:
-            out = classify_text(client, texto)
-            cats = out.get("categorias", [])
-            just = out.get("justificativa", "")
-            conf = out.get("confianca", 0)
+    # SIGTERM dentro do loop cancela esta corrotina (como o Ctrl+C no asyncio.run),
+    # em vez de estourar SystemExit no meio de uma task
+    loop = asyncio.get_running_loop()
+    prev_sigterm = signal.getsignal(signal.SIGTERM)
+    loop.add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    try:
+        # checkpoint: cada resultado vai numa linha do JSONL; o CSV só é gravado no fim
+        with open(CHECKPOINT, "a", encoding="utf-8") as ckpt:
+            for fut in tqdm(asyncio.as_completed(tasks), total=len(tasks), desc="Classificando"):
+                h, (cats, just, conf), ok = await fut
+                for i in grupos[h]:
+                    results[i] = (cats, just, conf)
+                    if ok:
+                        write_checkpoint(ckpt, i, rids[i], cats, just, conf)
+                        atualizados += 1
+                if ok:
+                    cache.put(h, cats, just, conf)
+    finally:
+        # interrompido: cancela e recolhe as tasks em voo (nada fica sem await)
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        loop.remove_signal_handler(signal.SIGTERM)
+        signal.signal(signal.SIGTERM, prev_sigterm)
+        await client.close()
+    assign_results(df, results)
+    return atualizados
 
-            # Normalizações leves
-            if isinstance(cats, list):
-                cats = ", ".join([c.strip() for c in cats if c and isinstance(c, str)])
-            else:
-                cats = str(cats)
+def submit_batch(client: OpenAI, textos: dict[str, str]):
+    """Envia à Batch API um request por texto distinto (custom_id = sha1 do texto)
+    e grava o id do batch em BATCH_STATE, para uma nova execução retomar."""
+    lines = [json.dumps({
+        "custom_id": h,
+        "method": "POST",
+        "url": "/v1/chat/completions",
+        "body": request_body(texto),
+    }, ensure_ascii=False) for h, texto in textos.items()]
+    up = client.files.create(
+        file=("classificar_ia_batch.jsonl", "\n".join(lines).encode("utf-8")),
+        purpose="batch",
+    )
+    batch = client.batches.create(
+        input_file_id=up.id, endpoint="/v1/chat/completions", completion_window="24h"
+    )
+    with open(BATCH_STATE, "w", encoding="utf-8") as f:
+        json.dump({"batch_id": batch.id}, f)
+    print(f"📨 Batch {batch.id} enviado com {len(lines)} texto(s). Aguardando conclusão...")
+    return batch
 
-            try:
-                conf = float(conf)
-            except Exception:
-                conf = 0.0
+def pending_batch(client: OpenAI):
+    """Batch de uma execução anterior ainda aproveitável (em andamento ou concluído)."""
+    if not os.path.exists(BATCH_STATE):
+        return None
+    with open(BATCH_STATE, encoding="utf-8") as f:
+        batch = client.batches.retrieve(json.load(f)["batch_id"])
+    if batch.status in ("failed", "expired", "cancelled"):
+        os.remove(BATCH_STATE)
+        return None
+    print(f"♻️  Retomando batch {batch.id} (status={batch.status}).")
+    return batch
 
-            df.at[i, "categorias_ia"] = cats
-            df.at[i, "justificativa_ia"] = just
-            df.at[i, "confianca_ia"] = conf
+def classify_batch(df: pd.DataFrame, idxs: list, api_key: str, cache: ClassifyCache) -> int:
+    """Modo --batch: envia tudo à Batch API (até 24h, ~metade do preço) e mescla o resultado.
+
+    Textos repetidos viram um único request; o id do batch fica em BATCH_STATE,
+    então uma execução interrompida volta a consultar o mesmo batch em vez de pagar outro.
+    """
+    client = OpenAI(api_key=api_key)
+
+    atualizados = 0
+    results = {}                     # linha -> (categorias, justificativa, confianca)
+    grupos: dict[str, list] = {}     # sha1(texto) -> linhas com esse texto
+    textos_h: dict[str, str] = {}    # sha1(texto) -> texto (um request por texto distinto)
+    textos = df.loc[idxs, "texto"].fillna("").astype(str).str.strip().tolist()
+    for i, texto in zip(idxs, textos):
+        if not texto:
+            results[i] = ("", "Sem texto", 0.0)
             atualizados += 1
+            continue
+        h = ClassifyCache.key(texto)
+        if (hit := cache.get(h)) is not None:
+            results[i] = tuple(hit)
+            atualizados += 1
+            continue
+        textos_h[h] = texto
+        grupos.setdefault(h, []).append(i)
+    if not grupos:
+        assign_results(df, results)
+        return atualizados
+
+    batch = pending_batch(client) or submit_batch(client, textos_h)
+    while batch.status not in ("completed", "failed", "expired", "cancelled"):
+        time.sleep(BATCH_POLL)
+        batch = client.batches.retrieve(batch.id)
+        rc = batch.request_counts
+        print(f"   status={batch.status} ({rc.completed if rc else 0}/{rc.total if rc else '?'})", flush=True)
+
+    if not batch.output_file_id:
+        os.remove(BATCH_STATE)
+        raise SystemExit(f"Batch {batch.id} terminou sem saída (status={batch.status}).")
 
+    respondidos = set()
+    for line in client.files.content(batch.output_file_id).text.splitlines():
+        item = json.loads(line)
+        h = item["custom_id"]
+        respondidos.add(h)
+        try:
+            body = item["response"]["body"]
+            cats, just, conf = normalize_output(json.loads(body["choices"][0]["message"]["content"]))
         except Exception as e:
-            # Em caso de erro, mantém vazio e segue
-            df.at[i, "categorias_ia"] = ""
-            df.at[i, "justificativa_ia"] = f"Erro: {e}"
-            df.at[i, "confianca_ia"] = 0.0
+            cats, just, conf = "", f"Erro: {item.get('error') or e}", 0.0
+        else:
+            cache.put(h, cats, just, conf)
+            atualizados += len(grupos.get(h, ()))
+        for i in grupos.get(h, ()):
+            results[i] = (cats, just, conf)
 
-        # checkpoint a cada 50
-        if atualizados % 50 == 0:
-            df.to_csv(CSV_PATH, index=False, encoding="utf-8-sig")
+    if batch.error_file_id:
+        for line in client.files.content(batch.error_file_id).text.splitlines():
+            item = json.loads(line)
+            h = item["custom_id"]
+            respondidos.add(h)
+            for i in grupos.get(h, ()):
+                results[i] = ("", f"Erro: {item.get('error') or item.get('response')}", 0.0)
 
-        # Respiro leve para evitar rate-limit agressivo
-        time.sleep(0.05)
+    # resultados gravados no cache; o batch não precisa mais ser retomado
+    cache.commit()
+    os.remove(BATCH_STATE)
+    faltam = sum(len(v) for h, v in grupos.items() if h not in respondidos)
+    if faltam:
+        print(f"⏭️  {faltam} linha(s) fora do batch retomado; ficam para a próxima execução.")
 
-    # Salvar final
-    df.to_csv(CSV_PATH, index=False, encoding="utf-8-sig")
+    assign_results(df, results)
+    return atualizados
+
+def main(df_in: pd.DataFrame | None = None, batch: bool = False) -> pd.DataFrame:
+    """Classifica as linhas sem categorias_ia. Com `df_in`, usa o DataFrame já
+    carregado (run_all) em vez de reler a base; grava e devolve a base classificada."""
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        raise SystemExit("Defina OPENAI_API_KEY no ambiente.")
+
+    # Carregar base final (ou usar a recebida em memória)
+    df = df_in if df_in is not None else read_final()
+    if df is None:
+        raise SystemExit(f"Arquivo não encontrado: {FINAL_PARQUET} nem {CSV_PATH}")
+
+    # Garantir colunas destino
+    for col in ["categorias_ia", "justificativa_ia", "confianca_ia"]:
+        if col not in df.columns:
+            df[col] = ""
+    # numérica desde já: assign_results/apply_checkpoint gravam floats em bloco
+    df["confianca_ia"] = pd.to_numeric(df["confianca_ia"], errors="coerce")
+
+    retomados = apply_checkpoint(df)
+    if retomados:
+        print(f"♻️  Retomando: {retomados} linha(s) recuperadas de {CHECKPOINT}")
+
+    mask = need_mask(df)
+    idxs = df.index[mask].tolist()
+
+    if not idxs:
+        # com df_in (run_all) a base mesclada ainda não foi gravada
+        if retomados or df_in is not None:
+            write_final(df)
+        if retomados:
+            os.remove(CHECKPOINT)
+        print("✅ Nada a classificar. Todas as linhas já possuem categorias_ia.")
+        return df
+
+    backup_csv(df)
+
+    # SIGTERM (ex.: job cancelado no runner) vira SystemExit, para cair no
+    # bloco abaixo e gravar a base com o que já está no checkpoint; o handler
+    # anterior volta no finally (o run_all chama main() no mesmo processo)
+    prev_sigterm = signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
+
+    cache = ClassifyCache()
+    try:
+        if batch:
+            print(f"Classificando via Batch API: {len(idxs)} item(ns). Modelo: {MODEL}")
+            atualizados = classify_batch(df, idxs, api_key, cache)
+        else:
+            print(f"Classificando apenas as linhas novas: {len(idxs)} item(ns). Modelo: {MODEL} "
+                  f"(concorrência: {CONCURRENCY})")
+
+            # Chamadas concorrentes limitadas pelo semáforo; o RateGate pausa só
+            # quando os headers de rate limit apertam e o tenacity cobre os 429
+            atualizados = asyncio.run(classify_rows(df, idxs, api_key, cache))
+    except (KeyboardInterrupt, SystemExit, asyncio.CancelledError) as e:
+        # interrompido: materializa uma vez os resultados do checkpoint (que fica
+        # no disco para a próxima execução retomar o resto)
+        if apply_checkpoint(df):
+            write_final(df)
+            print(f"⏹️  Interrompido; resultados parciais gravados em {FINAL_PARQUET}.")
+        if isinstance(e, asyncio.CancelledError):   # SIGTERM durante o asyncio.run
+            raise SystemExit(128 + signal.SIGTERM) from None
+        raise
+    finally:
+        signal.signal(signal.SIGTERM, prev_sigterm)
+        cache.close()
+
+    # Salvar final (única gravação da base); o checkpoint já não é necessário
+    write_final(df)
+    if os.path.exists(CHECKPOINT):
+        os.remove(CHECKPOINT)
     print(f"✅ Classificação concluída. Atualizadas {atualizados} linha(s).")
+    return df
 
 if __name__ == "__main__":
-    main()
+    main(batch="--batch" in sys.argv[1:])
@@ -0,0 +1,2 @@
+# conftest.py na raiz: o pytest põe esta pasta no sys.path, então os testes
+# importam os scripts (classificar_ia, baixar_reviews, ...) direto
@@ -1,39 +1,60 @@
 # run_all.py
-import subprocess
-import sys
 import os
 import pandas as pd
 
-RAW_CSV   = "reviews_clickcannabis.csv"          # saída do baixar_reviews.py (bruto)
-FINAL_CSV = "reviews_clickcannabis_ia.csv"       # base lida pelo app / classificador
+from baixar_reviews import main as baixar
+from classificar_ia import (
+    FINAL_PARQUET, CSV_PATH as FINAL_CSV, need_mask, read_final, write_final,
+    main as classificar,
+)
+from schema import CSV_DTYPES
 
-def run(cmd):
-    print(">>>", " ".join(cmd), flush=True)
-    subprocess.check_call(cmd)
+CSV_CHUNKSIZE = 200_000                             # linhas por bloco na leitura de CSV grande
+DEDUPE_KEYS   = ["review_id", "texto"]
 
-def read_csv_safe(path: str) -> pd.DataFrame:
+def read_csv_safe(path: str, chunksize: int = CSV_CHUNKSIZE) -> pd.DataFrame:
+    """Lê o CSV (vazio se não existir) em blocos, já deduplicando cada bloco,
+    para não segurar as duplicatas na memória."""
     if not os.path.exists(path):
         return pd.DataFrame()
-    return pd.read_csv(path)
+    chunks = []
+    for c in pd.read_csv(path, dtype=CSV_DTYPES, chunksize=chunksize):
+        keys = [k for k in DEDUPE_KEYS if k in c.columns]
+        chunks.append(c.drop_duplicates(subset=keys) if keys else c)
+    return pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame()
+
+def read_final_safe() -> pd.DataFrame:
+    """Base FINAL pelo leitor do classificador; enquanto o Parquet não existe
+    (migração), lê o CSV em blocos."""
+    if os.path.exists(FINAL_PARQUET):
+        return read_final()
+    return read_csv_safe(FINAL_CSV)
 
 def sort_and_dedupe(df: pd.DataFrame) -> pd.DataFrame:
     # Ordena por data se existir
     if "data_iso" in df.columns:
-        df["data_iso_sort"] = pd.to_datetime(df["data_iso"], errors="coerce", utc=True)
-        df = df.sort_values("data_iso_sort", ascending=False).drop(columns=["data_iso_sort"])
+        # data_iso é ISO (ou data relativa, que vira NaT): formato fixo, sem inferência por valor
+        df["data_iso_sort"] = pd.to_datetime(df["data_iso"], format="ISO8601", errors="coerce", utc=True)
+        # estável: entre datas iguais mantém a ordem do concat (FINAL antes do bruto)
+        df = df.sort_values("data_iso_sort", ascending=False, kind="stable").drop(columns=["data_iso_sort"])
     # Dedupe por review_id + texto (fallback se faltar review_id)
-    keys = [c for c in ["review_id", "texto"] if c in df.columns]
-    if keys:
+    keys = [c for c in DEDUPE_KEYS if c in df.columns]
+    if "review_id" in keys:
+        # hash só do review_id; o texto entra apenas no (pequeno) grupo de ids repetidos
+        dup = df["review_id"].duplicated(keep=False).to_numpy()
+        keep = ~dup
+        if dup.any():
+            keep[dup] = ~df[dup].duplicated(subset=keys, keep="first").to_numpy()
+        df = df[keep]
+    elif keys:
         df = df.drop_duplicates(subset=keys, keep="first")
     else:
         df = df.drop_duplicates(keep="first")
     return df
 
 def count_unclassified(df: pd.DataFrame) -> int:
-    if "categorias_ia" not in df.columns:
-        return len(df)
-    s = df["categorias_ia"].astype(str).str.strip().str.lower()
-    return (s.eq("") | s.eq("nan") | s.eq("none")).sum()
+    # mesmo critério do classificador (NaN incluso, também com dtype string)
+    return int(need_mask(df).sum())
 
 def unique_ids_count(df: pd.DataFrame) -> int:
     if "review_id" not in df.columns:
@@ -41,12 +62,12 @@ def unique_ids_count(df: pd.DataFrame) -> int:
     return df["review_id"].astype(str).nunique()
 
 def main():
-    # 1) Baixar novos reviews
-    run([sys.executable, "baixar_reviews.py"])
+    # 1) Baixar novos reviews (em processo: a base bruta volta já em memória)
+    print(">>> baixar_reviews", flush=True)
+    df_raw = baixar()
 
     # 2) Mesclar bruto -> final (para que a IA processe APENAS o que ainda não tem categorias_ia)
-    df_raw = read_csv_safe(RAW_CSV)
-    df_final_before = read_csv_safe(FINAL_CSV)
+    df_final_before = read_final_safe()
 
     ids_before = unique_ids_count(df_final_before)
     to_classify_before = count_unclassified(df_final_before)
@@ -63,22 +84,24 @@ def main():
         df_merged = pd.concat([df_final_before, df_raw], ignore_index=True)
 
     df_merged = sort_and_dedupe(df_merged)
-    # Salva a base FINAL já com os novos reviews incorporados (ainda sem categorias_ia para os novos)
-    df_merged.to_csv(FINAL_CSV, index=False, encoding="utf-8-sig")
     print(f"📦 FINAL pronto para classificar: {len(df_merged)} linhas")
 
-    # 3) Classificar com IA (só linhas sem categorias_ia)
-    run([sys.executable, "classificar_ia.py"])
-
-    # 4) Sanitizar/garantir dedupe após a classificação
-    df_final_after = read_csv_safe(FINAL_CSV)
-    if df_final_after.empty:
+    # 3) Classificar com IA (só linhas sem categorias_ia), sobre o DataFrame mesclado.
+    # O classificador grava a base FINAL (Parquet + CSV do app) uma única vez;
+    # a classificação não muda linhas, então não há novo dedupe depois
+    print(">>> classificar_ia", flush=True)
+    try:
+        df_final_after = classificar(df_merged)
+    except BaseException:
+        # classificador abortou (sem OPENAI_API_KEY, batch sem saída, SIGTERM...):
+        # grava a base mesclada para os reviews novos não ficarem fora do app
+        write_final(df_merged)
+        raise
+
+    if df_final_after is None or df_final_after.empty:
         print("⚠️ FINAL ficou vazio após classificação? Verifique os logs.")
         return
 
-    df_final_after = sort_and_dedupe(df_final_after)
-    df_final_after.to_csv(FINAL_CSV, index=False, encoding="utf-8-sig")
-
     # ======= RESUMO =======
     ids_after = unique_ids_count(df_final_after)
     new_reviews = max(ids_after - ids_before, 0)
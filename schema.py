@@ -0,0 +1,24 @@
+# schema.py
+# Colunas e tipos das bases, compartilhados por baixar_reviews, classificar_ia,
+# run_all e app (sem dependências além do Python).
+
+# colunas do CSV/Parquet bruto, na ordem em que são gravadas
+REVIEW_COLUMNS = (
+    "autor_nome", "autor_perfil_link", "autor_foto", "rating", "data_original",
+    "data_iso", "texto", "review_link", "review_id", "helpful_votes",
+    "imagens_do_review",
+)
+
+# tipos fixos na leitura de CSV: sem inferência por coluna (e review_id fica texto)
+RAW_DTYPES = {
+    "autor_nome": str, "autor_perfil_link": str, "autor_foto": str,
+    "rating": "float64", "data_original": str, "data_iso": str, "texto": str,
+    "review_link": str, "review_id": str, "imagens_do_review": str,
+}
+
+# base FINAL = bruto + colunas do classificador e do "Já usei"
+CSV_DTYPES = {
+    **RAW_DTYPES,
+    "categorias_ia": str, "confianca_ia": "float64", "justificativa_ia": str,
+    "usado_em": str,
+}
@@ -0,0 +1,52 @@
+import asyncio
+import json
+
+import httpx
+from openai import AsyncOpenAI
+
+import classificar_ia
+
+
+def completion(content: dict) -> dict:
+    return {
+        "id": "chatcmpl-test",
+        "object": "chat.completion",
+        "created": 0,
+        "model": classificar_ia.MODEL,
+        "choices": [{
+            "index": 0,
+            "finish_reason": "stop",
+            "message": {"role": "assistant", "content": json.dumps(content)},
+        }],
+    }
+
+
+def test_classify_text_via_mock_transport():
+    resposta = {"categorias": ["Sono"], "justificativa": "Dorme melhor.", "confianca": 0.9}
+    pedidos = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        pedidos.append(json.loads(request.content))
+        return httpx.Response(
+            200, json=completion(resposta),
+            headers={"x-ratelimit-remaining-requests": "0", "x-ratelimit-reset-requests": "20ms"},
+        )
+
+    async def run():
+        client = AsyncOpenAI(
+            api_key="test", max_retries=0,
+            http_client=httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+        )
+        gate = classificar_ia.RateGate()
+        try:
+            return await classificar_ia.classify_text(client, gate, "Durmo bem agora."), gate
+        finally:
+            await client.close()
+
+    out, gate = asyncio.run(run())
+
+    assert out == resposta
+    assert classificar_ia.normalize_output(out) == ("Sono", "Dorme melhor.", 0.9)
+    assert pedidos[0]["response_format"] == classificar_ia.RESPONSE_FORMAT
+    assert pedidos[0]["messages"][-1]["content"].endswith('"""\nDurmo bem agora.\n"""')
+    assert gate.resume_at > 0   # sem folga nos headers: o gate agenda a pausa